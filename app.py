@@ -6,17 +6,43 @@ and provides natural language explanations of the best moves.
 
 import os
 from flask import Flask, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 from dotenv import load_dotenv
-import base64
-import tempfile
+import re
+import hashlib
+import chess
+import orjson
+from functools import lru_cache
+from typing import Optional, Tuple
 
 from chess_analyzer import ChessAnalyzer
 from image_recognizer import ChessImageRecognizer
+from openai_client import get_client
 
 load_dotenv()
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes and parses with orjson's C implementation."""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        option = orjson.OPT_INDENT_2 if kwargs.get('indent') else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+# Largest screenshot accepted, and its size once base64-encoded
+_MAX_IMAGE_BYTES = 8 * 1024 * 1024
+_MAX_IMAGE_BASE64_CHARS = 4 * -(-_MAX_IMAGE_BYTES // 3)
+
 app = Flask(__name__, static_folder='static')
+app.json = OrjsonProvider(app)
+# Bound the whole request body: a base64 image plus room for the other fields
+app.config['MAX_CONTENT_LENGTH'] = _MAX_IMAGE_BASE64_CHARS + 64 * 1024
 CORS(app)
 
 # Initialize components
@@ -24,6 +50,188 @@ analyzer = ChessAnalyzer()
 image_recognizer = ChessImageRecognizer()
 
 
+_BASE64_RE = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+
+# Cheap FEN shape check; trailing fields are optional as in python-chess
+_FEN_RE = re.compile(
+    r'\s*[rnbqkpRNBQKP1-8]{1,8}(?:/[rnbqkpRNBQKP1-8]{1,8}){7}'
+    r'(?:\s+[wb](?:\s+(?:-|[KQkqA-Ha-h]{1,4})(?:\s+(?:-|[a-h][36])(?:\s+\d+(?:\s+\d+)?)?)?)?)?\s*'
+)
+
+_MALFORMED_FEN_MESSAGE = "Invalid FEN: malformed FEN string"
+_INVALID_PARAMS_MESSAGE = "Invalid analysis parameters"
+_ENGINE_UNAVAILABLE_MESSAGE = "Analysis engine unavailable"
+_INVALID_IMAGE_MESSAGE = "Image processing error: invalid image data"
+_RECOGNITION_UNAVAILABLE_MESSAGE = "Image recognition unavailable"
+
+# Accepted analysis parameters. Depth is also capped at the server's
+# max_depth; num_moves is Stockfish's MultiPV, which errors outside 1-500
+_MAX_DEPTH = 100
+_MAX_NUM_MOVES = 20
+
+
+def _check_analysis_params(depth, num_moves=None) -> Optional[tuple]:
+    """
+    Return a 400 response unless depth and num_moves are positive ints in range.
+    
+    Out-of-range values would otherwise reach the engine and come back as
+    engine errors, which the routes report as 503s. None means "use the default".
+    """
+    for value, limit in ((depth, _MAX_DEPTH), (num_moves, _MAX_NUM_MOVES)):
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= limit:
+            return jsonify({"error": _INVALID_PARAMS_MESSAGE}), 400
+    return None
+
+
+def _is_fen_shaped(fen) -> bool:
+    """Cheaply check that a value looks like a FEN before handing it to python-chess."""
+    return isinstance(fen, str) and _FEN_RE.fullmatch(fen) is not None
+
+
+def _image_payload(image_data: str) -> str:
+    """
+    Strip the data URL prefix from a base64 image and check its alphabet.
+    
+    The vision API consumes base64 directly, so the payload is forwarded
+    as-is instead of being decoded into a fresh buffer and re-encoded.
+    """
+    if not isinstance(image_data, str):
+        raise ValueError("Invalid base64 image data")
+    if len(image_data) > _MAX_IMAGE_BASE64_CHARS + 256:  # allow for the data URL prefix
+        raise RequestEntityTooLarge()
+    image_data = image_data.partition(',')[2] or image_data
+    if len(image_data) > _MAX_IMAGE_BASE64_CHARS:
+        raise RequestEntityTooLarge()
+    if len(image_data) % 4 or not _BASE64_RE.fullmatch(image_data):
+        raise ValueError("Invalid base64 image data")
+    return image_data
+
+
+def _read_request():
+    """
+    Return (data, image_file) for a JSON or multipart/form-data request.
+    
+    Multipart uploads carry the image as raw bytes in the 'image' file field,
+    avoiding the base64 inflation and decode of the JSON body.
+    """
+    if request.mimetype != 'multipart/form-data':
+        return request.get_json(), None
+    
+    data = request.form.to_dict()
+    for key in ('depth', 'num_moves'):
+        value = request.form.get(key, type=int)
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+    return data, request.files.get('image')
+
+
+def _recognize_image(image_file, image_data) -> Optional[str]:
+    """Recognize a chess position from an uploaded file or a base64 image."""
+    if image_file:
+        image = image_file.read(_MAX_IMAGE_BYTES + 1)
+        if len(image) > _MAX_IMAGE_BYTES:
+            raise RequestEntityTooLarge()
+        media_type = image_file.mimetype if image_file.mimetype.startswith('image/') else 'image/png'
+        return image_recognizer.recognize_bytes(image, media_type)
+    return image_recognizer.recognize_base64(_image_payload(image_data))
+
+
+def _image_to_fen(image_file, image_data) -> Tuple[Optional[str], Optional[tuple]]:
+    """
+    Recognize an image for a route, returning (fen, None) or (None, error response).
+    
+    A fen of None with no error response means the image was processed
+    but no position was recognized; each route words that case itself.
+    """
+    try:
+        return _recognize_image(image_file, image_data), None
+    except ValueError as e:
+        print(f"Image processing error: {e}")
+        return None, (jsonify({"error": _INVALID_IMAGE_MESSAGE}), 400)
+    except RuntimeError as e:
+        # Image recognition is not configured
+        print(f"Image recognition error: {e}")
+        return None, (jsonify({"error": _RECOGNITION_UNAVAILABLE_MESSAGE}), 503)
+
+
+class _UncachedAnalysis(Exception):
+    """Carries an analysis payload out of _cached_analysis without memoizing it."""
+    
+    def __init__(self, payload: str):
+        super().__init__()
+        self.payload = payload
+
+
+@lru_cache(maxsize=1024)
+def _cached_analysis(fen: str, depth: int, num_moves: int, lang: str = 'en') -> str:
+    """
+    Analyze a position and return the serialized JSON result.
+    
+    Results are memoized per (fen, depth, num_moves, lang) so re-submitting
+    the same position skips Stockfish and the explanation call entirely.
+    Storing the JSON text also means a hit costs no re-encoding.
+    
+    A result whose AI explanation failed is raised as _UncachedAnalysis
+    instead, since lru_cache doesn't keep raised calls: a transient OpenAI
+    error shouldn't pin the fallback text to the position.
+    """
+    result = analyzer.analyze(fen, depth=depth, num_moves=num_moves, lang=lang)
+    payload = app.json.dumps(result)
+    if result['explanation_fallback']:
+        raise _UncachedAnalysis(payload)
+    return payload
+
+
+def _analysis_response(fen: str, depth: int, num_moves: int, lang: str = 'en'):
+    """
+    Build a JSON response for a (possibly cached) analysis, mapping analyzer errors to HTTP errors.
+    
+    Responses carry an ETag derived from the analysis arguments; a client
+    sending it back in If-None-Match gets a bare 304 without any analysis work.
+    The tag is weak: the explanation is sampled at temperature 0.7, so
+    another worker or a restart can produce different bytes for the same
+    arguments, but the analysis is equivalent.
+    """
+    etag = hashlib.blake2b(repr((fen, depth, num_moves, lang)).encode(), digest_size=16).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    try:
+        payload = _cached_analysis(fen, depth, num_moves, lang)
+    except _UncachedAnalysis as e:
+        # No ETag either, so the client doesn't keep revalidating the fallback
+        return app.response_class(e.payload, mimetype=app.json.mimetype)
+    except (ValueError, TypeError, RuntimeError) as e:
+        return _analysis_error_response(e)
+    
+    response = app.response_class(payload, mimetype=app.json.mimetype)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _analysis_error_response(error: Exception):
+    """Map an exception raised by the analyzer to an HTTP error response."""
+    if isinstance(error, ValueError):
+        return jsonify({"error": f"Analysis error: {error}"}), 400
+    if isinstance(error, TypeError):
+        return jsonify({"error": _INVALID_PARAMS_MESSAGE}), 400
+    # Stockfish missing or crashed (chess.engine.EngineError is a RuntimeError)
+    print(f"Analysis engine error: {error}")
+    return jsonify({"error": _ENGINE_UNAVAILABLE_MESSAGE}), 503
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """Report oversized uploads as JSON like the other API errors"""
+    return jsonify({"error": "Image too large"}), 413
+
+
 @app.route('/')
 def index():
     """Serve the main page"""
@@ -50,52 +258,90 @@ def analyze_position():
         "num_moves": optional number of moves to analyze (default 3),
         "lang": optional language code ("en" or "pt", default "en")
     }
+    
+    The image may also be sent as a multipart/form-data file field named
+    "image", with the other parameters as form fields.
     """
-    data = request.get_json()
+    data, image_file = _read_request()
     
-    if not data:
+    if not data and not image_file:
         return jsonify({"error": "No data provided"}), 400
     
+    data = data or {}
     fen = data.get('fen')
     image_data = data.get('image')
     depth = data.get('depth', 20)
     num_moves = data.get('num_moves', 3)
     lang = data.get('lang', 'en')
     
+    error = _check_analysis_params(depth, num_moves)
+    if error:
+        return error
+    
     # If image is provided, extract FEN from it
-    if image_data and not fen:
-        try:
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Decode and save temporarily
-            image_bytes = base64.b64decode(image_data)
-            
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                tmp.write(image_bytes)
-                tmp_path = tmp.name
-            
-            try:
-                fen = image_recognizer.recognize(tmp_path)
-            finally:
-                os.unlink(tmp_path)
-                
-            if not fen:
-                return jsonify({"error": "Could not recognize chess position from image"}), 400
-                
-        except Exception as e:
-            return jsonify({"error": f"Image processing error: {str(e)}"}), 400
+    if (image_file or image_data) and not fen:
+        fen, error = _image_to_fen(image_file, image_data)
+        if error:
+            return error
+        if not fen:
+            return jsonify({"error": "Could not recognize chess position from image"}), 400
     
     if not fen:
         return jsonify({"error": "No FEN or image provided"}), 400
+    if not _is_fen_shaped(fen):
+        return jsonify({"error": _MALFORMED_FEN_MESSAGE}), 400
     
     # Analyze the position
+    return _analysis_response(fen, depth, num_moves, lang)
+
+
+@app.route('/api/analyze-stream', methods=['POST'])
+def analyze_position_stream():
+    """
+    Analyze a FEN like /api/analyze, streaming the result as NDJSON.
+    
+    The first line is the engine analysis without its explanation; each
+    following line carries a piece of the explanation as it is generated.
+    
+    Request JSON:
+    {
+        "fen": "FEN string",
+        "depth": optional analysis depth (default 20),
+        "num_moves": optional number of moves to analyze (default 3),
+        "lang": optional language code ("en" or "pt", default "en")
+    }
+    """
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    fen = data.get('fen')
+    if not fen:
+        return jsonify({"error": "No FEN provided"}), 400
+    if not _is_fen_shaped(fen):
+        return jsonify({"error": _MALFORMED_FEN_MESSAGE}), 400
+    
+    depth = data.get('depth', 20)
+    num_moves = data.get('num_moves', 3)
+    error = _check_analysis_params(depth, num_moves)
+    if error:
+        return error
+    
+    events = analyzer.analyze_stream(fen, depth, num_moves, data.get('lang', 'en'))
+    
+    # Run the engine part up front so its errors still get a proper status code
     try:
-        result = analyzer.analyze(fen, depth=depth, num_moves=num_moves, lang=lang)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": f"Analysis error: {str(e)}"}), 400
+        first = next(events)
+    except (ValueError, TypeError, RuntimeError) as e:
+        return _analysis_error_response(e)
+    
+    def generate():
+        yield orjson.dumps(first) + b'\n'
+        for event in events:
+            yield orjson.dumps(event) + b'\n'
+    
+    return app.response_class(generate(), mimetype='application/x-ndjson')
 
 
 @app.route('/api/validate-fen', methods=['POST'])
@@ -104,6 +350,9 @@ def validate_fen():
     data = request.get_json()
     fen = data.get('fen', '')
     
+    if not _is_fen_shaped(fen):
+        return jsonify({"valid": False, "message": _MALFORMED_FEN_MESSAGE})
+    
     is_valid, message = analyzer.validate_fen(fen)
     return jsonify({"valid": is_valid, "message": message})
 
@@ -118,54 +367,39 @@ def recognize_position():
     {
         "image": "base64 encoded image"
     }
+    
+    Or multipart/form-data with the image as a file field named "image".
     """
-    data = request.get_json()
+    data, image_file = _read_request()
     
-    if not data:
+    if not data and not image_file:
         return jsonify({"error": "No data provided"}), 400
     
-    image_data = data.get('image')
+    image_data = (data or {}).get('image')
     
-    if not image_data:
+    if not image_file and not image_data:
         return jsonify({"error": "No image provided"}), 400
     
-    try:
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        # Decode and save temporarily
-        image_bytes = base64.b64decode(image_data)
-        
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-            tmp.write(image_bytes)
-            tmp_path = tmp.name
-        
-        try:
-            fen = image_recognizer.recognize(tmp_path)
-        finally:
-            os.unlink(tmp_path)
-            
-        if not fen:
-            return jsonify({"error": "Could not recognize chess position from image. Try using Manual Entry instead."}), 400
-        
-        # Validate the FEN structure (but don't require valid position)
-        # Just check it has the right format
-        parts = fen.split(' ')
-        if len(parts) < 1 or '/' not in parts[0]:
-            return jsonify({"error": "Recognition produced invalid format. Try using Manual Entry instead."}), 400
-        
-        # Determine turn from FEN
-        turn = 'white' if len(parts) < 2 or parts[1] == 'w' else 'black'
-        
-        return jsonify({
-            "success": True,
-            "fen": fen,
-            "turn": turn
-        })
-        
-    except Exception as e:
-        return jsonify({"error": f"Image processing error: {str(e)}"}), 400
+    fen, error = _image_to_fen(image_file, image_data)
+    if error:
+        return error
+    if not fen:
+        return jsonify({"error": "Could not recognize chess position from image. Try using Manual Entry instead."}), 400
+    
+    # Validate the FEN structure (but don't require valid position)
+    # Just check it has the right format
+    parts = fen.split(' ')
+    if len(parts) < 1 or '/' not in parts[0]:
+        return jsonify({"error": "Recognition produced invalid format. Try using Manual Entry instead."}), 400
+    
+    # Determine turn from FEN
+    turn = 'white' if len(parts) < 2 or parts[1] == 'w' else 'black'
+    
+    return jsonify({
+        "success": True,
+        "fen": fen,
+        "turn": turn
+    })
 
 
 @app.route('/api/correct-position', methods=['POST'])
@@ -193,38 +427,41 @@ def correct_position():
     
     if not original_fen or not correction:
         return jsonify({"error": "Both original_fen and correction are required"}), 400
+    error = _check_analysis_params(depth, num_moves)
+    if error:
+        return error
+    if not _is_fen_shaped(original_fen):
+        return jsonify({"error": _MALFORMED_FEN_MESSAGE}), 400
     
-    # Try to apply the correction using OpenAI
-    try:
-        corrected_fen = apply_fen_correction(original_fen, correction)
-        
-        if not corrected_fen:
-            return jsonify({"error": "Could not apply the correction. Please try editing the FEN directly."}), 400
-        
-        # Analyze the corrected position
-        result = analyzer.analyze(corrected_fen, depth=depth, num_moves=num_moves)
-        return jsonify(result)
-        
-    except Exception as e:
-        return jsonify({"error": f"Correction error: {str(e)}"}), 400
+    # Try to apply the correction locally, then with OpenAI
+    corrected_fen = apply_fen_correction(original_fen, correction)
+    
+    if not corrected_fen:
+        return jsonify({"error": "Could not apply the correction. Please try editing the FEN directly."}), 400
+    
+    # Analyze the corrected position
+    return _analysis_response(corrected_fen, depth, num_moves)
 
 
 def apply_fen_correction(original_fen: str, correction: str) -> str:
     """
-    Use OpenAI to apply a text correction to a FEN position.
+    Apply a text correction to a FEN position.
+    
+    Corrections that say exactly which piece moves where are applied
+    locally; anything vaguer goes to OpenAI, with the heuristic parser as
+    the fallback when there's no API key or the call fails.
     
     Returns the corrected FEN string, or None if correction failed.
     """
-    import os
-    from openai import OpenAI
+    exact_fen = _parse_exact_correction(original_fen, correction)
+    if exact_fen and analyzer.validate_fen(exact_fen)[0]:
+        return exact_fen
     
-    api_key = os.environ.get('OPENAI_API_KEY')
-    if not api_key:
-        # If no API key, try to parse simple corrections manually
+    # The shared client keeps its connection pool warm across modules
+    client = get_client()
+    if not client:
         return parse_simple_correction(original_fen, correction)
     
-    client = OpenAI(api_key=api_key)
-    
     prompt = f"""You are a chess FEN correction assistant. 
 
 Given this FEN position:
@@ -273,45 +510,103 @@ Return ONLY the corrected FEN string, nothing else."""
         return parse_simple_correction(original_fen, correction)
 
 
+# Lookup tables for parse_simple_correction
+# Pattern: "move X from Y to Z"
+_MOVE_RE = re.compile(
+    r'\b(king|queen|rook|bishop|knight|pawn)\b.*?\bfrom\s+([a-h][1-8])\b.*?\bto\s+([a-h][1-8])\b'
+)
+
+# Pattern: "X is on Y not Z"
+_NOT_ON_RE = re.compile(r'\bon\s+([a-h][1-8])\b,?\s+not\s+(?:on\s+)?([a-h][1-8])\b')
+
+# Pattern: "X is on Y not Z" or "X should be on Y"
+_SQUARE_RE = re.compile(r'\b([a-h][1-8])\b')
+_WORD_RE = re.compile(r'[a-z]+')
+
+_PIECE_MAP = {
+    'king': chess.KING, 'queen': chess.QUEEN, 'rook': chess.ROOK,
+    'bishop': chess.BISHOP, 'knight': chess.KNIGHT, 'pawn': chess.PAWN
+}
+
+_COLOR_MAP = {
+    'white': chess.WHITE, 'black': chess.BLACK
+}
+
+
+def _parse_exact_correction(original_fen: str, correction: str) -> Optional[str]:
+    """
+    Apply a correction that names exactly which piece moves where.
+    
+    Only "move X from Y to Z" and "X is on Y not Z" are handled, and only
+    when the named square holds that kind of piece. Anything vaguer
+    returns None rather than guessing which piece was meant.
+    """
+    if not _is_fen_shaped(original_fen):
+        return None
+    
+    try:
+        board = chess.Board(original_fen)
+    except ValueError:
+        return None
+    correction_lower = correction.lower()
+    words = set(_WORD_RE.findall(correction_lower))
+    
+    move_match = _MOVE_RE.search(correction_lower)
+    if move_match:
+        piece_name, from_name, to_name = move_match.groups()
+    else:
+        not_match = _NOT_ON_RE.search(correction_lower)
+        piece_names = [name for name in _PIECE_MAP if name in words]
+        if not not_match or len(piece_names) != 1:
+            return None
+        to_name, from_name = not_match.groups()
+        piece_name = piece_names[0]
+    
+    piece = board.piece_at(chess.parse_square(from_name))
+    if piece is None or piece.piece_type != _PIECE_MAP[piece_name]:
+        return None
+    colors = [color_val for color_name, color_val in _COLOR_MAP.items() if color_name in words]
+    if colors and piece.color not in colors:
+        return None
+    board.remove_piece_at(chess.parse_square(from_name))
+    board.set_piece_at(chess.parse_square(to_name), piece)
+    return board.fen()
+
+
 def parse_simple_correction(original_fen: str, correction: str) -> str:
     """
     Try to parse simple corrections without AI.
     Handles patterns like "king is on h8 not g8" or "move king from g8 to h8"
     """
-    import chess
-    import re
+    if not _is_fen_shaped(original_fen):
+        return None
     
     try:
         board = chess.Board(original_fen)
         correction_lower = correction.lower()
         
-        # Pattern: "X is on Y not Z" or "X should be on Y"
-        piece_map = {
-            'king': chess.KING, 'queen': chess.QUEEN, 'rook': chess.ROOK,
-            'bishop': chess.BISHOP, 'knight': chess.KNIGHT, 'pawn': chess.PAWN
-        }
+        if _MOVE_RE.search(correction_lower):
+            # A move from a square that doesn't hold that piece isn't guessed at
+            return _parse_exact_correction(original_fen, correction)
         
-        color_map = {
-            'white': chess.WHITE, 'black': chess.BLACK
-        }
+        words = set(_WORD_RE.findall(correction_lower))
+        has_not = 'not' in words
+        
+        # Find squares mentioned (e.g., h8, g8, a1)
+        squares = _SQUARE_RE.findall(correction_lower)
+        
+        # Determine color from context
+        color_hits = [color_val for color_name, color_val in _COLOR_MAP.items() if color_name in words]
         
         # Try to find piece, color, and squares mentioned
-        for piece_name, piece_type in piece_map.items():
-            if piece_name in correction_lower:
-                # Find squares mentioned (e.g., h8, g8, a1)
-                squares = re.findall(r'\b([a-h][1-8])\b', correction_lower)
-                
+        for piece_name, piece_type in _PIECE_MAP.items():
+            if piece_name in words:
                 if len(squares) >= 1:
-                    # Determine color from context
-                    color = None
-                    for color_name, color_val in color_map.items():
-                        if color_name in correction_lower:
-                            color = color_val
-                            break
+                    color = color_hits[0] if color_hits else None
                     
                     # If no color specified, try to infer from the piece being moved
                     if color is None and len(squares) >= 2:
-                        wrong_square = chess.parse_square(squares[1]) if 'not' in correction_lower else chess.parse_square(squares[0])
+                        wrong_square = chess.parse_square(squares[1]) if has_not else chess.parse_square(squares[0])
                         piece_at = board.piece_at(wrong_square)
                         if piece_at and piece_at.piece_type == piece_type:
                             color = piece_at.color
@@ -321,15 +616,11 @@ def parse_simple_correction(original_fen: str, correction: str) -> str:
                         correct_square = chess.parse_square(squares[0])
                         
                         # Find the wrong square (where the piece currently is incorrectly)
-                        if len(squares) >= 2 and 'not' in correction_lower:
+                        if len(squares) >= 2 and has_not:
                             wrong_square = chess.parse_square(squares[1])
                         else:
                             # Find where this piece type is for this color
-                            for sq in chess.SQUARES:
-                                p = board.piece_at(sq)
-                                if p and p.piece_type == piece_type and p.color == color:
-                                    wrong_square = sq
-                                    break
+                            wrong_square = next(iter(board.pieces(piece_type, color)), None)
                         
                         # Remove piece from wrong square and place on correct square
                         if wrong_square is not None:
@@ -372,14 +663,22 @@ def evaluate_move():
         return jsonify({"error": "FEN is required"}), 400
     if not move:
         return jsonify({"error": "Move is required"}), 400
+    error = _check_analysis_params(depth)
+    if error:
+        return error
+    if not _is_fen_shaped(fen):
+        return jsonify({"error": _MALFORMED_FEN_MESSAGE}), 400
     
     try:
         result = analyzer.evaluate_move(fen, move, depth=depth, lang=lang)
         return jsonify(result)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        return jsonify({"error": f"Evaluation error: {str(e)}"}), 400
+    except TypeError:
+        return jsonify({"error": _INVALID_PARAMS_MESSAGE}), 400
+    except RuntimeError as e:
+        print(f"Analysis engine error: {e}")
+        return jsonify({"error": _ENGINE_UNAVAILABLE_MESSAGE}), 503
 
 
 @app.route('/api/health', methods=['GET'])
@@ -395,5 +694,9 @@ def health_check():
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     debug = os.environ.get('DEBUG', 'false').lower() == 'true'
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    try:
+        app.run(host='0.0.0.0', port=port, debug=debug)
+    finally:
+        # Gunicorn does this in worker_exit; the dev server needs it here
+        analyzer.close()
 
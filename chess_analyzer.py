@@ -3,29 +3,48 @@ Chess Position Analyzer Module
 Handles chess engine integration and move explanation generation.
 """
 
+import bisect
 import chess
 import chess.engine
 import os
-from typing import Optional, Tuple, List, Dict, Any
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Optional, Tuple, List, Dict, Any, Callable, Iterator
 
+from openai_client import get_client
+
+# Container memory limit files (cgroups v1 and v2)
+_CGROUP_MEMORY_PATHS = (
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroups v1
+    '/sys/fs/cgroup/memory.max',  # cgroups v2
+)
+_CGROUP_UNLIMITED = 0x7FFFFFFFFFFFF000
+
+@lru_cache(maxsize=1)
 def get_memory_mb() -> int:
     """Get available system memory in MB, accounting for container limits."""
     
-    # Check for container memory limit first (cgroups v1 and v2)
-    cgroup_paths = [
-        '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroups v1
-        '/sys/fs/cgroup/memory.max',  # cgroups v2
-    ]
-    
-    for cgroup_path in cgroup_paths:
+    # Check for container memory limit first
+    for cgroup_path in _CGROUP_MEMORY_PATHS:
         try:
-            with open(cgroup_path, 'r') as f:
-                limit = f.read().strip()
-                if limit != 'max' and limit.isdigit():
-                    limit_mb = int(limit) // (1024 * 1024)
-                    # Only use if it's a reasonable limit (not unlimited)
-                    if limit_mb < 64000:  # Less than 64GB = real limit
-                        return limit_mb
+            # Tiny kernel file; read it raw instead of through a buffered text stream
+            fd = os.open(cgroup_path, os.O_RDONLY)
+            try:
+                limit = os.read(fd, 64).decode().strip()
+            finally:
+                os.close(fd)
+            if limit != 'max' and limit.isdigit():
+                limit_bytes = int(limit)
+                # cgroups v1 reports "unlimited" as LONG_MAX rounded down to a page
+                if limit_bytes >= _CGROUP_UNLIMITED:
+                    continue
+                limit_mb = limit_bytes // (1024 * 1024)
+                # Only use if it's a reasonable limit (not unlimited)
+                if limit_mb < 64000:  # Less than 64GB = real limit
+                    return limit_mb
         except:
             pass
     
@@ -39,6 +58,13 @@ def get_memory_mb() -> int:
     # Final fallback
     return 512
 
+def available_cpus() -> int:
+    """Count the CPUs this process may run on, honouring CPU affinity."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS or Windows
+        return os.cpu_count() or 1
+
 def is_cloud_environment() -> bool:
     """Detect if running in a cloud/container environment."""
     cloud_indicators = [
@@ -70,9 +96,12 @@ def get_optimal_settings() -> dict:
     
     memory_mb = get_memory_mb()
     
+    # Analyses here are a few seconds long, which only fills a few MB of
+    # hash per second; a larger table just costs cache hits, so desktop
+    # tiers stop at 64MB however much memory is free
     if memory_mb >= 8000:  # 8GB+ (good desktop/laptop)
         return {
-            "hash": 256,
+            "hash": 64,
             "threads": 4,
             "max_depth": 30,
             "default_depth": 22,
@@ -81,7 +110,7 @@ def get_optimal_settings() -> dict:
         }
     elif memory_mb >= 4000:  # 4GB+ (modest machine)
         return {
-            "hash": 128,
+            "hash": 64,
             "threads": 2,
             "max_depth": 25,
             "default_depth": 20,
@@ -107,86 +136,345 @@ def get_optimal_settings() -> dict:
             "cloud_mode": False
         }
 
+@lru_cache(maxsize=1)
+def _discover_stockfish() -> Optional[str]:
+    """Find Stockfish engine on the system."""
+    # Common locations for Stockfish
+    home = os.path.expanduser('~')
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    possible_paths = [
+        os.path.join(app_dir, 'bin', 'stockfish'),  # Project bin folder (Render)
+        os.path.join(home, 'bin', 'stockfish'),  # Home bin folder
+        './bin/stockfish',  # Relative path
+        '/usr/local/bin/stockfish',
+        '/usr/bin/stockfish',
+        '/usr/games/stockfish',
+        '/opt/homebrew/bin/stockfish',
+        'stockfish',  # If in PATH
+        os.path.join(app_dir, 'stockfish'),
+        os.path.join(app_dir, 'engines', 'stockfish'),
+    ]
+    
+    # Check environment variable first
+    env_path = os.environ.get('STOCKFISH_PATH')
+    if env_path:
+        possible_paths.insert(0, env_path)
+    
+    for path in possible_paths:
+        if os.path.isfile(path) or shutil.which(path) is not None:
+            return path
+    
+    return None
+
 # Get settings at module load
 OPTIMAL_SETTINGS = get_optimal_settings()
-from openai import OpenAI
+
+# Passed as the game key on every search. python-chess only sends
+# ucinewgame when the key changes, so Stockfish keeps its hash table
+# warm across requests instead of clearing it per position.
+_ENGINE_SESSION = "chess-analyzer"
+
+# Positions whose engine lines are kept in memory per analyzer
+ANALYSIS_CACHE_SIZE = 1024
+
+# Whichever comes first of these and the depth ends a search in cloud mode
+CLOUD_NODE_LIMIT = 2_000_000
+CLOUD_TIME_LIMIT = 8.0
+
+# Most engines one analyzer's pool will run
+MAX_ENGINE_POOL_SIZE = 4
+
+
+def get_engine_sizing() -> Tuple[int, int]:
+    """
+    Get (Stockfish threads, pool size) for this process's engines.
+    
+    Sizing is per host: every web worker's engines together should fit the
+    CPUs. Each worker gets an equal share of them for search threads, then
+    as many engines as that share fits, and only one on the cloud tier's
+    memory budget. A worker always gets at least one engine.
+    
+    Read when an analyzer is created rather than at import, so it sees the
+    worker count gunicorn_conf.py exports as WEB_CONCURRENCY.
+    """
+    workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    cpus = available_cpus()
+    threads = max(1, min(OPTIMAL_SETTINGS["threads"], cpus // workers))
+    if OPTIMAL_SETTINGS["cloud_mode"]:
+        return threads, 1
+    return threads, max(1, min(cpus // (threads * workers), MAX_ENGINE_POOL_SIZE))
+
+# Material values and piece_counts labels used by the material balance
+_PIECE_VALUES = {
+    chess.PAWN: 1,
+    chess.KNIGHT: 3,
+    chess.BISHOP: 3,
+    chess.ROOK: 5,
+    chess.QUEEN: 9,
+    chess.KING: 0
+}
+
+_PIECE_NAMES = {
+    chess.PAWN: 'pawns',
+    chess.KNIGHT: 'knights',
+    chess.BISHOP: 'bishops',
+    chess.ROOK: 'rooks',
+    chess.QUEEN: 'queens',
+    chess.KING: 'kings'
+}
+
+# Centipawn bands for describing a move's evaluation, from the mover's
+# side. Scores are integers, so 31 means "above 30": a band includes its
+# lower threshold, matching < -300 / < -100 / < -30 / > 30 / > 100 / > 300.
+_SCORE_THRESHOLDS = (-300, -100, -30, 31, 101, 301)
+_SCORE_KEYS = ('losing', 'worse', 'opponent_edge', 'equal', 'slight_edge', 'clear_advantage', 'decisive_advantage')
+
+# Template explanation text. Entries are format strings filled with
+# turn, opponent, phase, side and n when they are used.
+_TXT_EN = {
+    'position_assessment': '**Position Assessment**',
+    'turn_to_move': "It's {turn}'s turn to move. The game is in the {phase}.",
+    'material_advantage': "{side} has a material advantage of {n} pawn(s) worth of material.",
+    'material_equal': "Material is equal.",
+    'in_check': "⚠️ **{turn} is in check!** The immediate priority is to escape the check.",
+    'checkmate': "♔ **Checkmate!** {opponent} wins!",
+    'stalemate': "**Stalemate** - The game is a draw.",
+    'analysis_title': '**Analysis of Key Moves**',
+    'best_move': 'Best move',
+    'second_best': 'Second best',
+    'third_best': 'Third best',
+    'forced_mate': 'This move leads to a **forced checkmate**!',
+    'getting_mated': '⚠️ Despite being the best option, {turn} is getting checkmated. The position is lost.',
+    'decisive_advantage': '{turn} gains a **decisive advantage** with this move. The position becomes winning.',
+    'clear_advantage': 'This move gives {turn} a **clear advantage**. The position is favorable.',
+    'slight_edge': '{turn} maintains a **slight edge** with this move.',
+    'losing': '⚠️ Even with the best play, {turn} is in a **losing position**.',
+    'worse': '⚠️ {turn} is **worse** here, but this move limits the damage.',
+    'opponent_edge': '{opponent} has a slight edge, but the position remains playable.',
+    'equal': 'The position is **roughly equal** after this move.',
+    'why_sequence': '**Why this sequence?**',
+    'after_move': 'After',
+    'expected_response': 'the expected response is',
+    'game_continues': 'The game would likely continue:',
+    'followed_by': 'followed by',
+    'further_moves': 'Further moves in this line:',
+    'strategic_title': '**Strategic Considerations**',
+    'opening_advice': '• In the opening, focus on piece development, controlling the center, and king safety.',
+    'middlegame_advice': '• In the middlegame, look for tactical opportunities and improve piece coordination.',
+    'endgame_advice': '• In the endgame, king activity and pawn promotion become critical factors.',
+    'can_castle': 'can still castle',
+    'api_tip': '*For more detailed strategic insights with explanations of tactical motifs, add your OpenAI API key.*'
+}
+
+_TXT_PT = {
+    'position_assessment': '**Avaliação da Posição**',
+    'turn_to_move': "É a vez das {turn} jogarem. O jogo está na fase de {phase}.",
+    'material_advantage': "{side} têm vantagem material de {n} peão(s).",
+    'material_equal': "O material está igual.",
+    'in_check': "⚠️ **{turn} estão em xeque!** A prioridade imediata é escapar do xeque.",
+    'checkmate': "♔ **Xeque-mate!** {opponent} vencem!",
+    'stalemate': "**Afogamento** - O jogo é empate.",
+    'analysis_title': '**Análise dos Lances Principais**',
+    'best_move': 'Melhor lance',
+    'second_best': 'Segundo melhor',
+    'third_best': 'Terceiro melhor',
+    'forced_mate': 'Este lance leva a um **xeque-mate forçado**!',
+    'getting_mated': '⚠️ Apesar de ser a melhor opção, {turn} serão xeque-mateadas. A posição está perdida.',
+    'decisive_advantage': '{turn} obtêm uma **vantagem decisiva** com este lance. A posição fica ganha.',
+    'clear_advantage': 'Este lance dá a {turn} uma **vantagem clara**. A posição é favorável.',
+    'slight_edge': '{turn} mantêm uma **ligeira vantagem** com este lance.',
+    'losing': '⚠️ Mesmo com o melhor jogo, {turn} estão em **posição perdida**.',
+    'worse': '⚠️ {turn} estão **piores** aqui, mas este lance limita os danos.',
+    'opponent_edge': '{opponent} têm ligeira vantagem, mas a posição continua jogável.',
+    'equal': 'A posição é **aproximadamente igual** após este lance.',
+    'why_sequence': '**Por que esta sequência?**',
+    'after_move': 'Após',
+    'expected_response': 'a resposta esperada é',
+    'game_continues': 'O jogo provavelmente continuaria:',
+    'followed_by': 'seguido de',
+    'further_moves': 'Lances seguintes nesta linha:',
+    'strategic_title': '**Considerações Estratégicas**',
+    'opening_advice': '• Na abertura, foque no desenvolvimento das peças, controle do centro e segurança do rei.',
+    'middlegame_advice': '• No meio-jogo, busque oportunidades táticas e melhore a coordenação das peças.',
+    'endgame_advice': '• No final, a atividade do rei e a promoção de peões são fatores críticos.',
+    'can_castle': 'ainda podem rocar',
+    'api_tip': '*Para insights estratégicos mais detalhados com explicações de motivos táticos, adicione sua chave de API do OpenAI.*'
+}
+
+
+class ChessEnginePool:
+    """
+    A small pool of configured Stockfish processes shared by request threads.
+    
+    A SimpleEngine runs one command at a time, so each concurrent search
+    needs its own process. Engines start lazily, up to size, and each is
+    configured once when it starts.
+    
+    Owners must call close() before exiting: each SimpleEngine runs on a
+    non-daemon thread, so the interpreter won't shut down while one is open.
+    """
+    
+    def __init__(self, engine_path: Optional[str], size: int, threads: int = 1):
+        self.engine_path = engine_path
+        self.size = size
+        self.threads = threads
+        self._idle: List[chess.engine.SimpleEngine] = []
+        self._count = 0
+        # Signalled whenever an engine is released or a slot is freed
+        self._available = threading.Condition()
+    
+    def acquire(self) -> chess.engine.SimpleEngine:
+        """
+        Take an engine out of the pool.
+        
+        Reuses an idle engine if there is one, starts a new one while the
+        pool is below size, and otherwise waits until an engine is released
+        or a discarded engine's slot can be refilled.
+        """
+        with self._available:
+            while not self._idle and self._count >= self.size:
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        
+        try:
+            return self._start_engine()
+        except Exception:
+            self._free_slot()
+            raise
+    
+    def ensure_started(self):
+        """
+        Start an engine if the pool has none, without waiting for busy ones.
+        
+        An engine that is running, idle or checked out, is enough; this
+        never queues behind a search for one.
+        """
+        with self._available:
+            if self._count > 0:
+                return
+            self._count += 1
+        try:
+            engine = self._start_engine()
+        except Exception:
+            self._free_slot()
+            raise
+        self.release(engine)
+    
+    def release(self, engine: chess.engine.SimpleEngine):
+        """Return an engine to the pool."""
+        with self._available:
+            self._idle.append(engine)
+            self._available.notify()
+    
+    def discard(self, engine: chess.engine.SimpleEngine):
+        """Drop an engine whose process died, letting a waiter start a new one."""
+        self._free_slot()
+        try:
+            engine.quit()
+        except Exception:
+            pass
+    
+    def close(self):
+        """Quit every idle engine in the pool."""
+        with self._available:
+            engines, self._idle = self._idle, []
+        for engine in engines:
+            try:
+                engine.quit()
+            except Exception:
+                pass
+    
+    def _free_slot(self):
+        """Give up a reserved engine slot and wake one waiter to use it."""
+        with self._available:
+            self._count -= 1
+            self._available.notify()
+    
+    def _start_engine(self) -> chess.engine.SimpleEngine:
+        """Start and configure a new chess engine instance."""
+        if not self.engine_path:
+            raise RuntimeError(
+                "Stockfish not found. Please install Stockfish:\n"
+                "  macOS: brew install stockfish\n"
+                "  Ubuntu: sudo apt install stockfish\n"
+                "  Or set STOCKFISH_PATH environment variable"
+            )
+        engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+        # Configure based on available system memory
+        engine.configure({
+            "Hash": OPTIMAL_SETTINGS["hash"],
+            "Threads": self.threads
+        })
+        memory_mb = OPTIMAL_SETTINGS["memory_mb"]
+        print(f"Stockfish configured: {memory_mb}MB RAM detected → Hash={OPTIMAL_SETTINGS['hash']}MB, Threads={self.threads}")
+        return engine
 
 
 class ChessAnalyzer:
     """Analyzes chess positions using Stockfish and generates explanations."""
     
     def __init__(self):
-        self.engine_path = self._find_engine()
-        self.engine = None
-        self.openai_client = None
-        
-        # Initialize OpenAI if API key is available
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if api_key:
-            self.openai_client = OpenAI(api_key=api_key)
-    
-    def _find_engine(self) -> Optional[str]:
-        """Find Stockfish engine on the system."""
-        # Common locations for Stockfish
-        home = os.path.expanduser('~')
-        app_dir = os.path.dirname(os.path.abspath(__file__))
-        possible_paths = [
-            os.path.join(app_dir, 'bin', 'stockfish'),  # Project bin folder (Render)
-            os.path.join(home, 'bin', 'stockfish'),  # Home bin folder
-            './bin/stockfish',  # Relative path
-            '/usr/local/bin/stockfish',
-            '/usr/bin/stockfish',
-            '/usr/games/stockfish',
-            '/opt/homebrew/bin/stockfish',
-            'stockfish',  # If in PATH
-            os.path.join(app_dir, 'stockfish'),
-            os.path.join(app_dir, 'engines', 'stockfish'),
-        ]
-        
-        # Check environment variable first
-        env_path = os.environ.get('STOCKFISH_PATH')
-        if env_path:
-            possible_paths.insert(0, env_path)
-        
-        for path in possible_paths:
-            if os.path.isfile(path) or self._check_command_exists(path):
-                return path
-        
-        return None
-    
-    def _check_command_exists(self, cmd: str) -> bool:
-        """Check if a command exists in PATH."""
-        import shutil
-        return shutil.which(cmd) is not None
-    
-    def _get_engine(self) -> chess.engine.SimpleEngine:
-        """Get or create the chess engine instance."""
-        if self.engine is None:
-            if not self.engine_path:
-                raise RuntimeError(
-                    "Stockfish not found. Please install Stockfish:\n"
-                    "  macOS: brew install stockfish\n"
-                    "  Ubuntu: sudo apt install stockfish\n"
-                    "  Or set STOCKFISH_PATH environment variable"
-                )
-            self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
-            # Configure based on available system memory
-            self.engine.configure({
-                "Hash": OPTIMAL_SETTINGS["hash"],
-                "Threads": OPTIMAL_SETTINGS["threads"]
-            })
-            memory_mb = get_memory_mb()
-            print(f"Stockfish configured: {memory_mb}MB RAM detected → Hash={OPTIMAL_SETTINGS['hash']}MB, Threads={OPTIMAL_SETTINGS['threads']}")
-        return self.engine
+        self.engine_path = _discover_stockfish()
+        
+        # Each concurrent request checks out its own engine from the pool
+        threads, pool_size = get_engine_sizing()
+        self.pool = ChessEnginePool(self.engine_path, pool_size, threads)
+        
+        # Raw engine lines keyed by (normalized FEN, depth, num_moves);
+        # explanations are rebuilt per request since they depend on lang
+        self._analysis_cache: "OrderedDict[Tuple[str, int, int], List[Dict[str, Any]]]" = OrderedDict()
+        self._analysis_cache_lock = threading.Lock()
+        
+        # Shared OpenAI client, or None if no API key is configured
+        self.openai_client = get_client()
+    
+    @contextmanager
+    def _checkout_engine(self):
+        """Borrow an engine from the pool for the duration of a with-block."""
+        engine = self.pool.acquire()
+        try:
+            yield engine
+        except chess.engine.EngineTerminatedError:
+            # Don't hand a dead process to the next request
+            self.pool.discard(engine)
+            raise
+        except BaseException:
+            self.pool.release(engine)
+            raise
+        else:
+            self.pool.release(engine)
     
     def check_engine(self) -> bool:
-        """Check if the chess engine is available."""
+        """
+        Check if the chess engine is available.
+        
+        Health checks must not wait behind a running search, so an engine
+        that has already started counts as available, and one is only
+        started when the pool has none.
+        """
         try:
-            engine = self._get_engine()
-            return engine is not None
+            self.pool.ensure_started()
+            return True
         except Exception:
             return False
     
+    def _parse_fen(self, fen: str) -> chess.Board:
+        """
+        Parse a FEN string into a board, checking the position is legal.
+        
+        Raises:
+            ValueError: with the same message validate_fen reports
+        """
+        try:
+            board = chess.Board(fen)
+        except ValueError as e:
+            raise ValueError(f"Invalid FEN: {str(e)}") from e
+        if not board.is_valid():
+            raise ValueError("Invalid board position")
+        return board
+    
     def validate_fen(self, fen: str) -> Tuple[bool, str]:
         """
         Validate a FEN string.
@@ -195,13 +483,10 @@ class ChessAnalyzer:
             Tuple of (is_valid, message)
         """
         try:
-            board = chess.Board(fen)
-            if board.is_valid():
-                return True, "Valid FEN"
-            else:
-                return False, "Invalid board position"
+            self._parse_fen(fen)
         except ValueError as e:
-            return False, f"Invalid FEN: {str(e)}"
+            return False, str(e)
+        return True, "Valid FEN"
     
     def analyze(self, fen: str, depth: int = None, num_moves: int = 3, lang: str = 'en') -> Dict[str, Any]:
         """
@@ -216,12 +501,65 @@ class ChessAnalyzer:
             lang: Language code for explanations ('en' or 'pt')
             
         Returns:
-            Dictionary with analysis results and explanations
+            Dictionary with analysis results and explanations.
+            'explanation_fallback' is True when the AI explanation failed
+            and the template one was used in its place.
+        """
+        board, depth, best_moves, position_context = self._analyze_lines(fen, depth, num_moves)
+        
+        # Generate natural language explanation
+        failures: List[Exception] = []
+        explanation = self._generate_explanation(board, best_moves, position_context, lang, failures=failures)
+        
+        return {
+            'fen': fen,
+            'turn': 'white' if board.turn else 'black',
+            'position_context': position_context,
+            'best_moves': best_moves,
+            'explanation': explanation,
+            'explanation_fallback': bool(failures),
+            'analysis_depth': depth
+        }
+    
+    def analyze_stream(self, fen: str, depth: int = None, num_moves: int = 3, lang: str = 'en') -> Iterator[Dict[str, Any]]:
+        """
+        Analyze a chess position, yielding the engine results before the explanation.
+        
+        The first item is the analysis without its explanation, tagged
+        'type': 'analysis'. The explanation follows as 'type': 'explanation'
+        items whose 'text' pieces concatenate to what analyze() returns, so
+        clients can show the moves while the LLM is still writing.
+        
+        Raises:
+            ValueError: on an invalid FEN, before anything is yielded
+        """
+        board, depth, best_moves, position_context = self._analyze_lines(fen, depth, num_moves)
+        
+        yield {
+            'type': 'analysis',
+            'fen': fen,
+            'turn': 'white' if board.turn else 'black',
+            'position_context': position_context,
+            'best_moves': best_moves,
+            'analysis_depth': depth
+        }
+        
+        if self.openai_client and best_moves:
+            pieces = self._iter_llm_explanation(board, best_moves, position_context, lang)
+        else:
+            pieces = (self._generate_template_explanation(board, best_moves, position_context, lang),)
+        for text in pieces:
+            yield {'type': 'explanation', 'text': text}
+    
+    def _analyze_lines(self, fen: str, depth: Optional[int], num_moves: int) -> Tuple[chess.Board, int, List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Run (or fetch cached) engine lines and format them for a response.
+        
+        Returns:
+            Tuple of (board, effective depth, best_moves, position_context)
         """
         # Validate FEN
-        is_valid, message = self.validate_fen(fen)
-        if not is_valid:
-            raise ValueError(message)
+        board = self._parse_fen(fen)
         
         # Use optimal depth based on system memory, with user override capped
         if depth is None:
@@ -229,34 +567,20 @@ class ChessAnalyzer:
         else:
             depth = min(depth, OPTIMAL_SETTINGS["max_depth"])
         
-        board = chess.Board(fen)
-        engine = self._get_engine()
-        
-        # Get multi-PV analysis (multiple best moves)
-        analysis_results = []
-        
-        with engine.analysis(board, chess.engine.Limit(depth=depth), multipv=num_moves) as analysis:
-            for info in analysis:
-                if 'multipv' in info:
-                    pv_index = info['multipv'] - 1
-                    
-                    # Extend results list if needed
-                    while len(analysis_results) <= pv_index:
-                        analysis_results.append({})
-                    
-                    result = analysis_results[pv_index]
-                    
-                    if 'score' in info:
-                        score = info['score'].white()
-                        result['score'] = self._format_score(score)
-                        result['score_value'] = score.score(mate_score=10000) if score.score() is not None else (10000 if score.mate() > 0 else -10000)
-                    
-                    if 'pv' in info:
-                        result['pv'] = [move.uci() for move in info['pv'][:10]]
-                        result['pv_san'] = self._pv_to_san(board, info['pv'][:10])
-                    
-                    if 'depth' in info:
-                        result['depth'] = info['depth']
+        # board.fen() only keeps the en passant square when a capture is
+        # legal, so equivalent positions share a cache entry
+        cache_key = (board.fen(), depth, num_moves)
+        with self._analysis_cache_lock:
+            analysis_results = self._analysis_cache.get(cache_key)
+            if analysis_results is not None:
+                self._analysis_cache.move_to_end(cache_key)
+        
+        if analysis_results is None:
+            analysis_results = self._run_analysis(board, depth, num_moves)
+            with self._analysis_cache_lock:
+                self._analysis_cache[cache_key] = analysis_results
+                if len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+                    self._analysis_cache.popitem(last=False)
         
         # Format the best moves
         best_moves = []
@@ -290,17 +614,52 @@ class ChessAnalyzer:
         # Generate position context
         position_context = self._get_position_context(board)
         
-        # Generate natural language explanation
-        explanation = self._generate_explanation(board, best_moves, position_context, lang)
-        
-        return {
-            'fen': fen,
-            'turn': 'white' if board.turn else 'black',
-            'position_context': position_context,
-            'best_moves': best_moves,
-            'explanation': explanation,
-            'analysis_depth': depth
-        }
+        return board, depth, best_moves, position_context
+    
+    def _search_limit(self, depth: int) -> chess.engine.Limit:
+        """Build the search limit, bounding nodes and time on the cloud tier."""
+        if OPTIMAL_SETTINGS["cloud_mode"]:
+            # One thread and 16MB of hash can take far too long on sharp positions
+            return chess.engine.Limit(depth=depth, nodes=CLOUD_NODE_LIMIT, time=CLOUD_TIME_LIMIT)
+        return chess.engine.Limit(depth=depth)
+    
+    def _run_analysis(self, board: chess.Board, depth: int, num_moves: int) -> List[Dict[str, Any]]:
+        """Run a multi-PV search and collect the latest info for each line."""
+        # Get multi-PV analysis (multiple best moves), one slot per requested line
+        analysis_results = [{} for _ in range(num_moves)]
+        # Lines that have reported the target depth; once all of them have,
+        # there is nothing left worth reading
+        completed = set()
+        
+        with self._checkout_engine() as engine, engine.analysis(board, self._search_limit(depth), multipv=num_moves, game=_ENGINE_SESSION) as analysis:
+            for info in analysis:
+                if 'multipv' in info:
+                    pv_index = info['multipv'] - 1
+                    result = analysis_results[pv_index]
+                    
+                    if 'score' in info:
+                        score = info['score'].white()
+                        result['score'] = self._format_score(score)
+                        result['score_value'] = score.score(mate_score=10000) if score.score() is not None else (10000 if score.mate() > 0 else -10000)
+                    
+                    if 'pv' in info:
+                        result['pv'] = info['pv'][:10]
+                    
+                    if 'depth' in info:
+                        result['depth'] = info['depth']
+                        if info['depth'] >= depth and 'pv' in info:
+                            completed.add(pv_index)
+                            if len(completed) == num_moves:
+                                break
+        
+        # Every depth overwrites the previous PV, so only convert the final ones to notation
+        for result in analysis_results:
+            if 'pv' in result:
+                pv = result['pv']
+                result['pv'] = [move.uci() for move in pv]
+                result['pv_san'] = self._pv_to_san(board, pv)
+        
+        return analysis_results
     
     def evaluate_move(self, fen: str, move: str, depth: int = None, lang: str = 'en') -> Dict[str, Any]:
         """
@@ -316,9 +675,7 @@ class ChessAnalyzer:
             Dictionary with move evaluation and comparison to best move
         """
         # Validate FEN
-        is_valid, message = self.validate_fen(fen)
-        if not is_valid:
-            raise ValueError(message)
+        board = self._parse_fen(fen)
         
         # Use optimal depth
         if depth is None:
@@ -326,7 +683,6 @@ class ChessAnalyzer:
         else:
             depth = min(depth, OPTIMAL_SETTINGS["max_depth"])
         
-        board = chess.Board(fen)
         is_white_turn = board.turn
         
         # Parse the move (try SAN first, then UCI)
@@ -345,17 +701,17 @@ class ChessAnalyzer:
         
         move_san = board.san(parsed_move)
         
-        engine = self._get_engine()
-        
-        # Get best move analysis
-        best_info = engine.analyse(board, chess.engine.Limit(depth=depth))
-        best_move = best_info['pv'][0] if 'pv' in best_info else None
-        best_score = best_info['score'].white() if 'score' in best_info else None
-        best_move_san = board.san(best_move) if best_move else "?"
+        with self._checkout_engine() as engine:
+            # Get best move analysis
+            best_info = engine.analyse(board, self._search_limit(depth), game=_ENGINE_SESSION)
+            best_move = best_info['pv'][0] if 'pv' in best_info else None
+            best_score = best_info['score'].white() if 'score' in best_info else None
+            best_move_san = board.san(best_move) if best_move else "?"
+            
+            # Make the user's move and analyze the resulting position
+            board.push(parsed_move)
+            after_info = engine.analyse(board, self._search_limit(depth), game=_ENGINE_SESSION)
         
-        # Make the user's move and analyze the resulting position
-        board.push(parsed_move)
-        after_info = engine.analyse(board, chess.engine.Limit(depth=depth))
         after_score = after_info['score'].white() if 'score' in after_info else None
         
         # Get the continuation line (best moves after the user's move)
@@ -576,12 +932,12 @@ Keep it concise and instructive for chess improvement."""
     def _pv_to_san(self, board: chess.Board, pv: List[chess.Move]) -> List[str]:
         """Convert a PV (list of moves) to SAN notation."""
         san_moves = []
-        temp_board = board.copy()
+        # The move history is irrelevant for notation, so don't copy it
+        temp_board = board.copy(stack=False)
         
         for move in pv:
             try:
-                san_moves.append(temp_board.san(move))
-                temp_board.push(move)
+                san_moves.append(temp_board.san_and_push(move))
             except Exception:
                 break
         
@@ -589,21 +945,27 @@ Keep it concise and instructive for chess improvement."""
     
     def _get_position_context(self, board: chess.Board) -> Dict[str, Any]:
         """Extract contextual information about the position."""
+        # Generate checkers and legal moves once; mate and stalemate follow from them
+        is_check = bool(board.checkers())
+        legal_moves_count = board.legal_moves.count()
+        # Boards here passed is_valid(), so castling rights only sit on the corner rooks
+        castling_rights = board.castling_rights
+        
         context = {
-            'is_check': board.is_check(),
-            'is_checkmate': board.is_checkmate(),
-            'is_stalemate': board.is_stalemate(),
-            'can_castle_kingside_white': board.has_kingside_castling_rights(chess.WHITE),
-            'can_castle_queenside_white': board.has_queenside_castling_rights(chess.WHITE),
-            'can_castle_kingside_black': board.has_kingside_castling_rights(chess.BLACK),
-            'can_castle_queenside_black': board.has_queenside_castling_rights(chess.BLACK),
+            'is_check': is_check,
+            'is_checkmate': is_check and not legal_moves_count,
+            'is_stalemate': not is_check and not legal_moves_count,
+            'can_castle_kingside_white': bool(castling_rights & chess.BB_H1),
+            'can_castle_queenside_white': bool(castling_rights & chess.BB_A1),
+            'can_castle_kingside_black': bool(castling_rights & chess.BB_H8),
+            'can_castle_queenside_black': bool(castling_rights & chess.BB_A8),
             'material_balance': self._calculate_material_balance(board),
             'move_number': board.fullmove_number,
-            'legal_moves_count': len(list(board.legal_moves)),
+            'legal_moves_count': legal_moves_count,
         }
         
         # Detect game phase
-        piece_count = len(board.piece_map())
+        piece_count = chess.popcount(board.occupied)
         if piece_count > 24:
             context['phase'] = 'opening'
         elif piece_count > 12:
@@ -615,37 +977,23 @@ Keep it concise and instructive for chess improvement."""
     
     def _calculate_material_balance(self, board: chess.Board) -> Dict[str, Any]:
         """Calculate material balance for both sides."""
-        piece_values = {
-            chess.PAWN: 1,
-            chess.KNIGHT: 3,
-            chess.BISHOP: 3,
-            chess.ROOK: 5,
-            chess.QUEEN: 9,
-            chess.KING: 0
-        }
-        
         white_material = 0
         black_material = 0
         piece_counts = {'white': {}, 'black': {}}
         
-        piece_names = {
-            chess.PAWN: 'pawns',
-            chess.KNIGHT: 'knights',
-            chess.BISHOP: 'bishops',
-            chess.ROOK: 'rooks',
-            chess.QUEEN: 'queens'
-        }
-        
-        for square, piece in board.piece_map().items():
-            value = piece_values.get(piece.piece_type, 0)
-            name = piece_names.get(piece.piece_type, 'kings')
+        # Count each piece type straight from its bitboard
+        for piece_type, value in _PIECE_VALUES.items():
+            name = _PIECE_NAMES[piece_type]
             
-            if piece.color == chess.WHITE:
-                white_material += value
-                piece_counts['white'][name] = piece_counts['white'].get(name, 0) + 1
-            else:
-                black_material += value
-                piece_counts['black'][name] = piece_counts['black'].get(name, 0) + 1
+            white_count = chess.popcount(board.pieces_mask(piece_type, chess.WHITE))
+            if white_count:
+                white_material += white_count * value
+                piece_counts['white'][name] = white_count
+            
+            black_count = chess.popcount(board.pieces_mask(piece_type, chess.BLACK))
+            if black_count:
+                black_material += black_count * value
+                piece_counts['black'][name] = black_count
         
         return {
             'white': white_material,
@@ -659,25 +1007,61 @@ Keep it concise and instructive for chess improvement."""
         board: chess.Board, 
         best_moves: List[Dict], 
         context: Dict[str, Any],
-        lang: str = 'en'
+        lang: str = 'en',
+        stream_callback: Optional[Callable[[str], None]] = None,
+        failures: Optional[List[Exception]] = None
     ) -> str:
-        """Generate a natural language explanation of the position and best moves."""
+        """
+        Generate a natural language explanation of the position and best moves.
+        
+        If stream_callback is given, it receives the explanation text piece
+        by piece as it becomes available. If failures is given, an OpenAI
+        error that forced the template fallback is appended to it.
+        """
         
         # If OpenAI is available, use it for sophisticated explanations
         if self.openai_client and best_moves:
-            return self._generate_llm_explanation(board, best_moves, context, lang)
+            return self._generate_llm_explanation(board, best_moves, context, lang, stream_callback, failures)
         
         # Fallback to template-based explanation
-        return self._generate_template_explanation(board, best_moves, context, lang)
+        explanation = self._generate_template_explanation(board, best_moves, context, lang)
+        if stream_callback:
+            stream_callback(explanation)
+        return explanation
     
     def _generate_llm_explanation(
         self, 
         board: chess.Board, 
         best_moves: List[Dict], 
         context: Dict[str, Any],
-        lang: str = 'en'
+        lang: str = 'en',
+        stream_callback: Optional[Callable[[str], None]] = None,
+        failures: Optional[List[Exception]] = None
     ) -> str:
-        """Generate explanation using OpenAI."""
+        """Generate explanation using OpenAI, passing tokens to stream_callback as they arrive."""
+        parts = []
+        for text in self._iter_llm_explanation(board, best_moves, context, lang, failures):
+            parts.append(text)
+            if stream_callback:
+                stream_callback(text)
+        return ''.join(parts)
+    
+    def _iter_llm_explanation(
+        self, 
+        board: chess.Board, 
+        best_moves: List[Dict], 
+        context: Dict[str, Any],
+        lang: str = 'en',
+        failures: Optional[List[Exception]] = None
+    ) -> Iterator[str]:
+        """
+        Stream an OpenAI explanation, yielding text pieces as they arrive.
+        
+        If the API fails before any text arrives, the template explanation is
+        yielded instead; if it fails mid-stream, only a note is added after
+        the partial text. Either way the error is appended to failures if
+        given.
+        """
         
         turn = "White" if board.turn else "Black"
         if lang == 'pt':
@@ -719,6 +1103,7 @@ Please provide:
 
 Keep the explanation clear and accessible, suitable for intermediate players. Use chess notation where helpful."""
 
+        yielded = False
         try:
             response = self.openai_client.chat.completions.create(
                 model="gpt-4o",
@@ -730,13 +1115,26 @@ Keep the explanation clear and accessible, suitable for intermediate players. Us
                     {"role": "user", "content": prompt}
                 ],
                 max_tokens=1000,
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
-            return response.choices[0].message.content
+            # Closing the stream returns its connection to the pool even if
+            # the consumer stops early, e.g. a disconnected NDJSON client
+            with response:
+                for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yielded = True
+                        yield chunk.choices[0].delta.content
         except Exception as e:
-            # Fallback to template if API fails
+            if failures is not None:
+                failures.append(e)
             note = "(Note: AI explanation unavailable)" if lang == 'en' else "(Nota: explicação da IA indisponível)"
-            return self._generate_template_explanation(board, best_moves, context, lang) + f"\n\n{note}: {str(e)}"
+            if yielded:
+                # Part of the explanation already went out; only flag the cut
+                yield f"\n\n{note}: {str(e)}"
+            else:
+                # Fallback to template if API fails
+                yield self._generate_template_explanation(board, best_moves, context, lang) + f"\n\n{note}: {str(e)}"
     
     def _generate_template_explanation(
         self, 
@@ -751,100 +1149,34 @@ Keep the explanation clear and accessible, suitable for intermediate players. Us
         
         # Translations
         if lang == 'pt':
+            txt = _TXT_PT
             turn = "Brancas" if board.turn else "Pretas"
             opponent = "Pretas" if board.turn else "Brancas"
-            txt = {
-                'position_assessment': '**Avaliação da Posição**',
-                'turn_to_move': f"É a vez das {turn} jogarem. O jogo está na fase de {self._translate_phase(context['phase'], lang)}.",
-                'material_advantage': lambda side, n: f"{side} têm vantagem material de {n} peão(s).",
-                'material_equal': "O material está igual.",
-                'in_check': f"⚠️ **{turn} estão em xeque!** A prioridade imediata é escapar do xeque.",
-                'checkmate': f"♔ **Xeque-mate!** {'Pretas' if board.turn else 'Brancas'} vencem!",
-                'stalemate': "**Afogamento** - O jogo é empate.",
-                'analysis_title': '**Análise dos Lances Principais**',
-                'best_move': 'Melhor lance',
-                'second_best': 'Segundo melhor',
-                'third_best': 'Terceiro melhor',
-                'forced_mate': 'Este lance leva a um **xeque-mate forçado**!',
-                'getting_mated': f'⚠️ Apesar de ser a melhor opção, {turn} serão xeque-mateadas. A posição está perdida.',
-                'decisive_advantage': f'{turn} obtêm uma **vantagem decisiva** com este lance. A posição fica ganha.',
-                'clear_advantage': f'Este lance dá a {turn} uma **vantagem clara**. A posição é favorável.',
-                'slight_edge': f'{turn} mantêm uma **ligeira vantagem** com este lance.',
-                'losing': f'⚠️ Mesmo com o melhor jogo, {turn} estão em **posição perdida**.',
-                'worse': f'⚠️ {turn} estão **piores** aqui, mas este lance limita os danos.',
-                'opponent_edge': f'{opponent} têm ligeira vantagem, mas a posição continua jogável.',
-                'equal': 'A posição é **aproximadamente igual** após este lance.',
-                'why_sequence': '**Por que esta sequência?**',
-                'after_move': 'Após',
-                'expected_response': 'a resposta esperada é',
-                'game_continues': 'O jogo provavelmente continuaria:',
-                'followed_by': 'seguido de',
-                'further_moves': 'Lances seguintes nesta linha:',
-                'strategic_title': '**Considerações Estratégicas**',
-                'opening_advice': '• Na abertura, foque no desenvolvimento das peças, controle do centro e segurança do rei.',
-                'middlegame_advice': '• No meio-jogo, busque oportunidades táticas e melhore a coordenação das peças.',
-                'endgame_advice': '• No final, a atividade do rei e a promoção de peões são fatores críticos.',
-                'can_castle': 'ainda podem rocar',
-                'api_tip': '*Para insights estratégicos mais detalhados com explicações de motivos táticos, adicione sua chave de API do OpenAI.*'
-            }
         else:
+            txt = _TXT_EN
             turn = "White" if board.turn else "Black"
             opponent = "Black" if board.turn else "White"
-            txt = {
-                'position_assessment': '**Position Assessment**',
-                'turn_to_move': f"It's {turn}'s turn to move. The game is in the {context['phase']}.",
-                'material_advantage': lambda side, n: f"{side} has a material advantage of {n} pawn(s) worth of material.",
-                'material_equal': "Material is equal.",
-                'in_check': f"⚠️ **{turn} is in check!** The immediate priority is to escape the check.",
-                'checkmate': f"♔ **Checkmate!** {'Black' if board.turn else 'White'} wins!",
-                'stalemate': "**Stalemate** - The game is a draw.",
-                'analysis_title': '**Analysis of Key Moves**',
-                'best_move': 'Best move',
-                'second_best': 'Second best',
-                'third_best': 'Third best',
-                'forced_mate': 'This move leads to a **forced checkmate**!',
-                'getting_mated': f'⚠️ Despite being the best option, {turn} is getting checkmated. The position is lost.',
-                'decisive_advantage': f'{turn} gains a **decisive advantage** with this move. The position becomes winning.',
-                'clear_advantage': f'This move gives {turn} a **clear advantage**. The position is favorable.',
-                'slight_edge': f'{turn} maintains a **slight edge** with this move.',
-                'losing': f'⚠️ Even with the best play, {turn} is in a **losing position**.',
-                'worse': f'⚠️ {turn} is **worse** here, but this move limits the damage.',
-                'opponent_edge': f'{opponent} has a slight edge, but the position remains playable.',
-                'equal': 'The position is **roughly equal** after this move.',
-                'why_sequence': '**Why this sequence?**',
-                'after_move': 'After',
-                'expected_response': 'the expected response is',
-                'game_continues': 'The game would likely continue:',
-                'followed_by': 'followed by',
-                'further_moves': 'Further moves in this line:',
-                'strategic_title': '**Strategic Considerations**',
-                'opening_advice': '• In the opening, focus on piece development, controlling the center, and king safety.',
-                'middlegame_advice': '• In the middlegame, look for tactical opportunities and improve piece coordination.',
-                'endgame_advice': '• In the endgame, king activity and pawn promotion become critical factors.',
-                'can_castle': 'can still castle',
-                'api_tip': '*For more detailed strategic insights with explanations of tactical motifs, add your OpenAI API key.*'
-            }
         
         # Position assessment
         lines.append(txt['position_assessment'])
-        lines.append(txt['turn_to_move'])
+        lines.append(txt['turn_to_move'].format(turn=turn, phase=self._translate_phase(context['phase'], lang)))
         
         # Material balance
         material = context['material_balance']
         if material['balance'] > 0:
             side = "White" if lang == 'en' else "Brancas"
-            lines.append(txt['material_advantage'](side, material['balance']))
+            lines.append(txt['material_advantage'].format(side=side, n=material['balance']))
         elif material['balance'] < 0:
             side = "Black" if lang == 'en' else "Pretas"
-            lines.append(txt['material_advantage'](side, abs(material['balance'])))
+            lines.append(txt['material_advantage'].format(side=side, n=abs(material['balance'])))
         else:
             lines.append(txt['material_equal'])
         
         # Check status
         if context['is_check']:
-            lines.append(txt['in_check'])
+            lines.append(txt['in_check'].format(turn=turn))
         if context['is_checkmate']:
-            lines.append(txt['checkmate'])
+            lines.append(txt['checkmate'].format(opponent=opponent))
             return "\n".join(lines)
         if context['is_stalemate']:
             lines.append(txt['stalemate'])
@@ -869,21 +1201,10 @@ Keep the explanation clear and accessible, suitable for intermediate players. Us
                 if move['score'].startswith('Mate in'):
                     lines.append(txt['forced_mate'])
                 elif move['score'].startswith('Mated in'):
-                    lines.append(txt['getting_mated'])
-                elif display_score_value > 300:
-                    lines.append(txt['decisive_advantage'])
-                elif display_score_value > 100:
-                    lines.append(txt['clear_advantage'])
-                elif display_score_value > 30:
-                    lines.append(txt['slight_edge'])
-                elif display_score_value < -300:
-                    lines.append(txt['losing'])
-                elif display_score_value < -100:
-                    lines.append(txt['worse'])
-                elif display_score_value < -30:
-                    lines.append(txt['opponent_edge'])
+                    lines.append(txt['getting_mated'].format(turn=turn))
                 else:
-                    lines.append(txt['equal'])
+                    key = _SCORE_KEYS[bisect.bisect_right(_SCORE_THRESHOLDS, display_score_value)]
+                    lines.append(txt[key].format(turn=turn, opponent=opponent))
                 
                 # Explain the continuation
                 full_line = move.get('full_line', [])
@@ -932,11 +1253,10 @@ Keep the explanation clear and accessible, suitable for intermediate players. Us
             return phases.get(phase, phase)
         return phase
     
+    def close(self):
+        """Quit the engines in the pool."""
+        self.pool.close()
+    
     def __del__(self):
-        """Clean up engine on destruction."""
-        if self.engine:
-            try:
-                self.engine.quit()
-            except Exception:
-                pass
-
+        """Clean up engines on destruction."""
+        self.close()
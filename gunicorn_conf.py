@@ -0,0 +1,42 @@
+"""
+Gunicorn configuration for production deployments.
+
+Run with: gunicorn -c gunicorn_conf.py app:app
+"""
+
+import os
+
+from chess_analyzer import OPTIMAL_SETTINGS, available_cpus
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# Each worker owns its own Stockfish process; threads overlap the
+# OpenAI round-trips that don't need the engine. The cloud tier's memory
+# only fits one worker, Python process and engine included
+if OPTIMAL_SETTINGS["cloud_mode"]:
+    default_workers = 1
+else:
+    default_workers = max(2, available_cpus() // 2)
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+# chess_analyzer sizes each worker's engines to share the host's CPUs
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import the app once in the master so workers share its memory copy-on-write
+preload_app = True
+
+# Deep analyses can take longer than gunicorn's 30s default
+timeout = 60
+
+
+def post_worker_init(worker):
+    """Start the worker's Stockfish process before it accepts requests."""
+    from app import analyzer
+    analyzer.check_engine()
+
+
+def worker_exit(server, worker):
+    """Quit the worker's Stockfish processes as it shuts down."""
+    from app import analyzer
+    analyzer.close()
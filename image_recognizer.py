@@ -3,10 +3,228 @@ Chess Image Recognition Module
 Converts screenshots of chess positions to FEN notation using computer vision.
 """
 
-import os
-import base64
-from typing import Optional
-from openai import OpenAI
+import io
+import json
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from itertools import islice
+from typing import Dict, Generator, Iterator, List, Optional, Tuple
+
+import chess
+from PIL import Image
+
+from openai_client import get_client
+
+# pybase64 encodes with SIMD where the CPU supports it; the standard
+# library module has the same b64encode and is used when it's missing
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# FEN fragments looked for in the model's reply. Piece placements are found
+# as plain runs of FEN characters and checked structurally, rather than with
+# one large pattern that can backtrack heavily on long runs
+_FEN_LINE_RE = re.compile(r'FEN:\s*(.+)', re.IGNORECASE)
+_PLACEMENT_RUN_RE = re.compile(r'[rnbqkpRNBQKP1-8/]{15,}')
+_FEN_FIELDS_RE = re.compile(r'\s+([wb])\s+([KQkq-]+)\s+([a-h][36]|-)\s+(\d+)\s+(\d+)')
+_TRAIL_PUNCT_RE = re.compile(r'[.!?].*$')
+
+# bytes.translate table giving the squares each piece-placement character
+# covers. Anything else maps to 64, so one stray byte spoils a rank's sum
+_RANK_SUM = bytes(
+    int(chr(i)) if '1' <= chr(i) <= '8' else 1 if chr(i) in 'pnbrqkPNBRQK' else 64
+    for i in range(256)
+)
+
+# Characters allowed in a castling field
+_CASTLING_CHARS = frozenset('KQkq-')
+
+# Longest side images are scaled down to before upload, and the size at or
+# below which one low-detail tile is enough for the vision model
+_VISION_MAX_SIDE = 768
+_LOW_DETAIL_MAX_SIDE = 512
+
+# Largest image, in pixels, decoded for downscaling (a 5K screenshot is
+# 14.7M). Its RGBA buffer is 64 MB, which the 512 MB tier can afford
+_MAX_PREPROCESS_PIXELS = 16_000_000
+
+# Recognized FENs kept per recognizer, keyed by image content hash. When
+# full, the oldest fifth is dropped rather than clearing everything
+_FEN_CACHE_SIZE = 256
+_FEN_CACHE_EVICT = _FEN_CACHE_SIZE // 5
+
+# Vision model tried first, and the stronger one used when it fails
+_DEFAULT_MODEL = "gpt-4o-mini"
+_FALLBACK_MODEL = "gpt-4o"
+
+# Vision prompts: the default asks for a FEN (the placement is enough),
+# the full one for all six fields
+_VISION_PROMPT_STRICT = "Give the FEN for this board. Set recognized to false if it is unreadable."
+_VISION_PROMPT_FULL = "Give the complete FEN (6 fields) for this board. Set recognized to false if it is unreadable."
+
+# Structured output schema for vision replies, so the FEN arrives as a JSON
+# field rather than somewhere in free text
+_FEN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "fen",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "fen": {"type": "string"},
+                "recognized": {"type": "boolean"}
+            },
+            "required": ["fen", "recognized"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Image types by file extension; anything else is sent as PNG
+_MEDIA_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp'
+}
+
+
+def _pick_image_hash():
+    """
+    Return the faster of hashlib.sha256 and hashlib.blake2b on this machine.
+    
+    OpenSSL's sha256 uses the CPU's SHA extensions where available, which
+    can beat blake2b; elsewhere blake2b wins. Timed once on a 1 MB sample.
+    """
+    sample = bytes(1024 * 1024)
+    timings = {}
+    for hash_ctor in (hashlib.sha256, hashlib.blake2b):
+        start = time.perf_counter()
+        for _ in range(3):
+            hash_ctor(sample).digest()
+        timings[hash_ctor] = time.perf_counter() - start
+    return min(timings, key=timings.get)
+
+
+_IMAGE_HASH = _pick_image_hash()
+
+
+def _image_key(image_data: bytes) -> bytes:
+    """Cache key for a piece of image data: a 16-byte content hash."""
+    return _IMAGE_HASH(image_data).digest()[:16]
+
+
+def _data_url(base64_image: str, media_type: str) -> str:
+    """
+    Build the data URL for an encoded image.
+    
+    Made once per image and shared by every model in the fallback cascade;
+    concatenating onto the large base64 string copies it a single time.
+    """
+    return "data:" + media_type + ";base64," + base64_image
+
+
+def _preprocess_image(image_bytes: bytes, media_type: str) -> Tuple[bytes, str, str]:
+    """
+    Shrink a screenshot to the size the vision model actually needs.
+    
+    An 8x8 board reads fine at 768px, while a 2x-DPI screenshot can be several
+    MB of upload and image tokens. Images that are already small enough to fit
+    one low-detail tile are sent with detail "low".
+    
+    Returns:
+        Tuple of (image bytes, media type, vision detail level). The original
+        bytes are kept if Pillow cannot read them, they decode to more than
+        _MAX_PREPROCESS_PIXELS, or re-encoding doesn't help.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Image.open only reads the header, so this check happens before
+            # a small compressed file can expand to hundreds of MB
+            width, height = image.size
+            if width * height > _MAX_PREPROCESS_PIXELS:
+                print(f"Image preprocessing skipped: {width}x{height} is over the pixel budget")
+                return image_bytes, media_type, 'high'
+            image.thumbnail((_VISION_MAX_SIDE, _VISION_MAX_SIDE), Image.LANCZOS)
+            detail = 'low' if max(image.size) <= _LOW_DETAIL_MAX_SIDE else 'high'
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            buffer = io.BytesIO()
+            image.save(buffer, format='WEBP', quality=85)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Image preprocessing skipped: {e}")
+        return image_bytes, media_type, 'high'
+    
+    webp_bytes = buffer.getvalue()
+    if len(webp_bytes) >= len(image_bytes):
+        return image_bytes, media_type, detail
+    return webp_bytes, 'image/webp', detail
+
+
+def _is_piece_placement(placement: str) -> bool:
+    """Check a FEN piece placement has 8 ranks of exactly 8 squares each."""
+    ranks = placement.encode('ascii', 'replace').split(b'/')
+    if len(ranks) != 8:
+        return False
+    for rank in ranks:
+        if sum(rank.translate(_RANK_SUM)) != 8:
+            return False
+    return True
+
+
+def _is_castling_field(field: str) -> bool:
+    """Check a FEN castling field only uses K, Q, k, q and '-'."""
+    return bool(field) and all(char in _CASTLING_CHARS for char in field)
+
+
+def _is_en_passant_field(field: str) -> bool:
+    """Check a FEN en passant field is '-' or a third- or sixth-rank square."""
+    return field == '-' or (len(field) == 2 and 'a' <= field[0] <= 'h' and field[1] in '36')
+
+
+# Checks for the FEN fields after the piece placement, in order, and the
+# values used when a field is missing
+_FEN_FIELD_DEFAULTS = ('w', '-', '-', '0', '1')
+_FEN_FIELD_CHECKS = (
+    lambda field: field in ('w', 'b'),
+    _is_castling_field,
+    _is_en_passant_field,
+    str.isdigit,
+    str.isdigit
+)
+
+
+def _quick_validate_fen(fen: str) -> bool:
+    """
+    Cheap structural check of a FEN, before building a chess.Board for it.
+    
+    Rejects malformed candidates without constructing a board. Trailing
+    fields may be missing, as chess.Board accepts, but those present must be
+    well formed. A FEN that passes still needs chess.Board to confirm it.
+    """
+    fields = fen.split()
+    if not 1 <= len(fields) <= 6 or not _is_piece_placement(fields[0]):
+        return False
+    return all(check(field) for check, field in zip(_FEN_FIELD_CHECKS, fields[1:]))
+
+
+def _iter_piece_placements(text: str) -> Iterator[Tuple[int, int]]:
+    """Yield the (start, end) span of each valid piece placement in text."""
+    for run in _PLACEMENT_RUN_RE.finditer(text):
+        start, end = run.span()
+        # Tolerate stray slashes around the placement, e.g. "…/RNBQKBNR/"
+        while start < end and text[start] == '/':
+            start += 1
+        while end > start and text[end - 1] == '/':
+            end -= 1
+        if _is_piece_placement(text[start:end]):
+            yield start, end
 
 
 class ChessImageRecognizer:
@@ -17,11 +235,12 @@ class ChessImageRecognizer:
     from various sources (chess.com, lichess.org, etc.)
     """
     
-    def __init__(self):
-        self.openai_client = None
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if api_key:
-            self.openai_client = OpenAI(api_key=api_key)
+    def __init__(self, model: str = _DEFAULT_MODEL):
+        self.openai_client = get_client()
+        # Boards the first model can't read are retried once with the stronger one
+        self.models = (model,) if model == _FALLBACK_MODEL else (model, _FALLBACK_MODEL)
+        self._fen_cache: Dict[bytes, str] = {}
+        self._fen_cache_lock = threading.Lock()
     
     def recognize(self, image_path: str) -> Optional[str]:
         """
@@ -33,24 +252,164 @@ class ChessImageRecognizer:
         Returns:
             FEN string representing the position, or None if recognition fails
         """
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image not found: {image_path}")
+        image_bytes, media_type = self._read_image(image_path)
+        return self.recognize_bytes(image_bytes, media_type)
+    
+    def recognize_bytes(self, image_bytes: bytes, media_type: str = 'image/png') -> Optional[str]:
+        """
+        Recognize a chess position from raw image bytes already held in memory.
         
-        # Use OpenAI Vision API for recognition
-        if self.openai_client:
-            return self._recognize_with_openai(image_path)
-        else:
+        Args:
+            image_bytes: Encoded image data (PNG, JPEG, ...)
+            media_type: MIME type of the image
+            
+        Returns:
+            FEN string representing the position, or None if recognition fails
+        """
+        self._require_openai()
+        key = _image_key(image_bytes)
+        fen = self._cached_fen(key)
+        if fen:
+            return fen
+        base64_image, media_type, detail = self._encode_image(image_bytes, media_type)
+        fen = self._call_vision(base64_image, media_type, detail)
+        self._store_fen(key, fen)
+        return fen
+    
+    def recognize_base64(self, base64_image: str, media_type: str = 'image/png') -> Optional[str]:
+        """
+        Recognize a chess position from image data that is already base64-encoded,
+        such as the payload of a data URL, without decoding it first.
+        
+        Args:
+            base64_image: Base64-encoded image data
+            media_type: MIME type of the image
+            
+        Returns:
+            FEN string representing the position, or None if recognition fails
+        """
+        self._require_openai()
+        key = _image_key(base64_image.encode('ascii'))
+        fen = self._cached_fen(key)
+        if fen:
+            return fen
+        fen = self._call_vision(base64_image, media_type)
+        self._store_fen(key, fen)
+        return fen
+    
+    async def recognize_many(self, image_paths: List[str], concurrency: int = 8) -> List[Optional[str]]:
+        """
+        Recognize chess positions from several image files concurrently.
+        
+        Vision calls are network-bound, so up to `concurrency` of them are
+        kept in flight at once. Cached images skip the API like recognize().
+        
+        Args:
+            image_paths: Paths to the image files
+            concurrency: Maximum number of simultaneous API requests
+            
+        Returns:
+            One FEN per path, in the same order; None where the file couldn't
+            be read or recognition failed
+        """
+        self._require_openai()
+        from openai import AsyncOpenAI
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def recognize_one(client, image_path: str) -> Optional[str]:
+            try:
+                image_bytes, media_type = await asyncio.to_thread(self._read_image, image_path)
+            except OSError as e:
+                # One unreadable file shouldn't sink the rest of the batch
+                print(f"Image read error: {e}")
+                return None
+            key = _image_key(image_bytes)
+            fen = self._cached_fen(key)
+            if fen:
+                return fen
+            async with semaphore:
+                base64_image, media_type, detail = await asyncio.to_thread(
+                    self._encode_image, image_bytes, media_type
+                )
+                cascade = self._vision_cascade(_data_url(base64_image, media_type), detail)
+                try:
+                    request = next(cascade)
+                    while True:
+                        try:
+                            response = await client.chat.completions.create(**request)
+                            reply = response.choices[0].message.content
+                        except Exception as e:
+                            print(f"OpenAI recognition error: {e}")
+                            reply = None
+                        request = cascade.send(reply)
+                except StopIteration as done:
+                    fen = done.value
+            self._store_fen(key, fen)
+            return fen
+        
+        # A path listed twice is only sent once
+        unique_paths = list(dict.fromkeys(image_paths))
+        async with AsyncOpenAI(api_key=self.openai_client.api_key) as client:
+            fens = await asyncio.gather(
+                *(recognize_one(client, image_path) for image_path in unique_paths)
+            )
+        fen_by_path = dict(zip(unique_paths, fens))
+        return [fen_by_path[image_path] for image_path in image_paths]
+    
+    def _read_image(self, image_path: str) -> Tuple[bytes, str]:
+        """Read an image file, returning (image bytes, media type)."""
+        # Determine the image type
+        ext = image_path[image_path.rfind('.'):].lower()
+        media_type = _MEDIA_TYPES.get(ext, 'image/png')
+        
+        try:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Image not found: {image_path}") from None
+        return image_bytes, media_type
+    
+    def _cached_fen(self, key: bytes) -> Optional[str]:
+        """Return the FEN previously recognized for an image key, if any."""
+        with self._fen_cache_lock:
+            return self._fen_cache.get(key)
+    
+    def _store_fen(self, key: bytes, fen: Optional[str]):
+        """
+        Remember a recognized FEN for an image key.
+        
+        Failures aren't stored: None also covers API errors and timeouts,
+        which are worth retrying on the next upload.
+        """
+        if not fen:
+            return
+        with self._fen_cache_lock:
+            if len(self._fen_cache) >= _FEN_CACHE_SIZE:
+                for old_key in list(islice(self._fen_cache, _FEN_CACHE_EVICT)):
+                    del self._fen_cache[old_key]
+            self._fen_cache[key] = fen
+    
+    def _require_openai(self):
+        """Raise if no OpenAI client is available for vision recognition."""
+        if not self.openai_client:
             raise RuntimeError(
                 "OpenAI API key not configured. "
                 "Set OPENAI_API_KEY in your .env file to enable image recognition."
             )
     
-    def _encode_image(self, image_path: str) -> str:
-        """Encode an image file to base64."""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    def _encode_image(self, image_bytes: bytes, media_type: str) -> Tuple[str, str, str]:
+        """
+        Shrink an image for the vision API and encode it to base64.
+        
+        Returns:
+            Tuple of (base64 data, media type, vision detail level)
+        """
+        image_bytes, media_type, detail = _preprocess_image(image_bytes, media_type)
+        return base64.b64encode(image_bytes).decode('ascii'), media_type, detail
     
-    def _recognize_with_openai(self, image_path: str) -> Optional[str]:
+    def _call_vision(self, base64_image: str, media_type: str, detail: str = 'high',
+                     full_fen: bool = False) -> Optional[str]:
         """
         Use OpenAI's vision API to recognize the chess position.
         
@@ -60,130 +419,154 @@ class ChessImageRecognizer:
         - Chess24
         - Physical chess boards (photos)
         - Chess diagrams from books/websites
+        
+        The cheaper model is asked first; if it can't produce a valid FEN,
+        the fallback model gets one more try. With full_fen the model is
+        asked for all six FEN fields instead of just the piece placement.
+        """
+        cascade = self._vision_cascade(_data_url(base64_image, media_type), detail, full_fen)
+        try:
+            request = next(cascade)
+            while True:
+                try:
+                    response = self.openai_client.chat.completions.create(**request)
+                    reply = response.choices[0].message.content
+                except Exception as e:
+                    print(f"OpenAI recognition error: {e}")
+                    reply = None
+                request = cascade.send(reply)
+        except StopIteration as done:
+            return done.value
+    
+    def _vision_cascade(self, image_url: str, detail: str,
+                        full_fen: bool = False) -> Generator[dict, Optional[str], Optional[str]]:
         """
+        Walk the model cascade for one image.
         
-        base64_image = self._encode_image(image_path)
+        Yields the request for each model in turn and is sent back the reply
+        text, or None if the call failed. Keeping the loop here lets the sync
+        and async callers differ only in how they make the request.
         
-        # Determine the image type
-        ext = os.path.splitext(image_path)[1].lower()
-        media_type = {
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp'
-        }.get(ext, 'image/png')
+        Returns:
+            The first valid FEN, or None once a call fails or every model
+            has been tried
+        """
+        for model in self.models:
+            reply = yield self._vision_request(image_url, detail, model, full_fen)
+            if reply is None:
+                return None
+            fen = self._parse_vision_result(reply, full_fen)
+            if fen:
+                return fen
+        return None
+    
+    def _vision_request(self, image_url: str, detail: str, model: str, full_fen: bool = False) -> dict:
+        """Build the chat completion arguments for recognizing one board image."""
+        return {
+            "model": model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": _VISION_PROMPT_FULL if full_fen else _VISION_PROMPT_STRICT
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_url,
+                                "detail": detail
+                            }
+                        }
+                    ]
+                }
+            ],
+            "response_format": _FEN_RESPONSE_FORMAT,
+            # The JSON wrapper takes about 10 tokens; six fields can run past
+            # the 40 a placement needs
+            "max_tokens": 70 if full_fen else 50,
+            "temperature": 0
+        }
+    
+    def _parse_vision_result(self, result: str, full_fen: bool = False) -> Optional[str]:
+        """
+        Turn the model's reply into a validated FEN, or None.
         
-        prompt = """Look at this chess board and output the FEN notation.
-
-Rules:
-- White pieces: K Q R B N P (uppercase)
-- Black pieces: k q r b n p (lowercase)  
-- Empty squares: use numbers 1-8
-- Ranks separated by /
-- Start from rank 8 (top) to rank 1 (bottom)
-
-Output ONLY the FEN position string, like:
-r4rk1/pp3ppp/2p2n2/4p3/3P4/3B1P2/PPP2P2/2KR3R
-
-If you cannot recognize the position, output: CANNOT_RECOGNIZE"""
-
+        Replies are normally JSON matching _FEN_RESPONSE_FORMAT. Plain text
+        replies, from models without structured outputs, go through the
+        regex recovery in _extract_fen_from_response instead.
+        """
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{media_type};base64,{base64_image}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=150,
-                temperature=0
-            )
-            
-            result = response.choices[0].message.content.strip()
-            
-            if "CANNOT_RECOGNIZE" in result:
+            reply = json.loads(result)
+        except ValueError:
+            reply = None
+        
+        if isinstance(reply, dict):
+            fen = reply.get('fen')
+            if not reply.get('recognized') or not isinstance(fen, str):
                 return None
-            
+            fen = self._clean_fen(fen)
+            return fen if self._validate_fen(fen) else None
+        
+        result = result.strip()
+        
+        if full_fen:
+            if result == "CANNOT_RECOGNIZE":
+                return None
+            fen = self._clean_fen(result)
+        elif "CANNOT_RECOGNIZE" in result:
+            return None
+        else:
             # Extract FEN from the response
             fen = self._extract_fen_from_response(result)
-            
-            if fen and self._validate_fen(fen):
-                return fen
-            
-            return None
-            
-        except Exception as e:
-            print(f"OpenAI recognition error: {e}")
-            return None
+        
+        if fen and self._validate_fen(fen):
+            return fen
+        
+        return None
     
     def _extract_fen_from_response(self, response: str) -> Optional[str]:
-        """Extract and clean FEN from the model's response."""
-        import re
+        """
+        Extract and clean FEN from the model's response.
+        
+        Candidates are only checked structurally here; the caller confirms
+        the one returned with a full chess.Board parse.
+        """
+        # Fast path: the reply is usually just the FEN, possibly partial
+        cleaned = self._clean_fen(response.strip())
+        if _quick_validate_fen(cleaned):
+            return cleaned
         
         # Method 1: Look for "FEN:" prefix
-        fen_line_match = re.search(r'FEN:\s*(.+)', response, re.IGNORECASE)
+        fen_line_match = _FEN_LINE_RE.search(response)
         if fen_line_match:
             fen_candidate = fen_line_match.group(1).strip()
             cleaned = self._clean_fen(fen_candidate)
-            if self._validate_fen(cleaned):
+            if _quick_validate_fen(cleaned):
                 return cleaned
         
-        # Method 2: Look for a line that looks like a complete FEN
-        # FEN pattern: 8 ranks separated by /, followed by turn, castling, etc.
-        fen_pattern = r'([rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+)\s+([wb])\s+([KQkq-]+)\s+([a-h][36]|-)\s+(\d+)\s+(\d+)'
-        full_match = re.search(fen_pattern, response)
-        if full_match:
-            return full_match.group(0)
+        # Method 2: Look for a piece placement followed by the other FEN fields
+        for start, end in _iter_piece_placements(response):
+            fields_match = _FEN_FIELDS_RE.match(response, end)
+            if fields_match:
+                return response[start:fields_match.end()]
         
         # Method 3: Just find the piece placement and add defaults
-        piece_pattern = r'[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+/[rnbqkpRNBQKP1-8]+'
-        piece_match = re.search(piece_pattern, response)
-        if piece_match:
-            piece_placement = piece_match.group(0)
-            # Validate that it has correct structure (8 ranks)
-            ranks = piece_placement.split('/')
-            if len(ranks) == 8:
-                # Check each rank sums to 8
-                valid = True
-                for rank in ranks:
-                    total = 0
-                    for char in rank:
-                        if char.isdigit():
-                            total += int(char)
-                        else:
-                            total += 1
-                    if total != 8:
-                        valid = False
-                        break
-                
-                if valid:
-                    return f"{piece_placement} w - - 0 1"
+        placement = next(_iter_piece_placements(response), None)
+        if placement:
+            start, end = placement
+            return f"{response[start:end]} w - - 0 1"
         
         return None
     
     def _clean_fen(self, fen: str) -> str:
         """Clean up a FEN string by removing extra whitespace and fixing common issues."""
-        import re
-        
         # Remove any markdown formatting
         fen = fen.replace('`', '').strip()
         
         # Remove any trailing punctuation or extra text
-        fen = re.sub(r'[.!?].*$', '', fen).strip()
+        fen = _TRAIL_PUNCT_RE.sub('', fen).strip()
         
         # Split and clean
         parts = fen.split()
@@ -192,56 +575,22 @@ If you cannot recognize the position, output: CANNOT_RECOGNIZE"""
             return fen
         
         # The first part should be the piece placement (contains '/')
-        piece_placement = None
-        remaining_parts = []
-        
-        for part in parts:
-            if '/' in part and piece_placement is None:
-                piece_placement = part
-            elif piece_placement is not None:
-                remaining_parts.append(part)
-        
-        if not piece_placement:
-            return fen
-        
-        # Rebuild with defaults
-        result_parts = [piece_placement]
-        
-        # Turn (w or b)
-        if len(remaining_parts) > 0 and remaining_parts[0] in ['w', 'b']:
-            result_parts.append(remaining_parts[0])
-            remaining_parts = remaining_parts[1:]
+        for i, part in enumerate(parts):
+            if '/' in part:
+                break
         else:
-            result_parts.append('w')
-        
-        # Castling
-        if len(remaining_parts) > 0 and re.match(r'^[KQkq-]+$', remaining_parts[0]):
-            result_parts.append(remaining_parts[0])
-            remaining_parts = remaining_parts[1:]
-        else:
-            result_parts.append('-')
-        
-        # En passant
-        if len(remaining_parts) > 0 and re.match(r'^([a-h][36]|-)$', remaining_parts[0]):
-            result_parts.append(remaining_parts[0])
-            remaining_parts = remaining_parts[1:]
-        else:
-            result_parts.append('-')
-        
-        # Halfmove clock
-        if len(remaining_parts) > 0 and remaining_parts[0].isdigit():
-            result_parts.append(remaining_parts[0])
-            remaining_parts = remaining_parts[1:]
-        else:
-            result_parts.append('0')
+            return fen
+        piece_placement = part
+        i += 1
         
-        # Fullmove number
-        if len(remaining_parts) > 0 and remaining_parts[0].isdigit():
-            result_parts.append(remaining_parts[0])
-        else:
-            result_parts.append('1')
+        # Rebuild with defaults, taking each field only if the next part fits it
+        result_parts = [piece_placement, *_FEN_FIELD_DEFAULTS]
+        for field, check in enumerate(_FEN_FIELD_CHECKS, 1):
+            if i < len(parts) and check(parts[i]):
+                result_parts[field] = parts[i]
+                i += 1
         
-        return ' '.join(result_parts[:6])
+        return ' '.join(result_parts)
     
     def _validate_fen(self, fen: str) -> bool:
         """
@@ -249,9 +598,10 @@ If you cannot recognize the position, output: CANNOT_RECOGNIZE"""
         
         Returns True if the FEN appears to be valid, False otherwise.
         """
+        if not _quick_validate_fen(fen):
+            return False
         try:
-            import chess
-            board = chess.Board(fen)
+            chess.Board(fen)
             return True
         except Exception:
             return False
@@ -267,55 +617,5 @@ If you cannot recognize the position, output: CANNOT_RECOGNIZE"""
         Returns:
             FEN string representing the position, or None if recognition fails
         """
-        if not self.openai_client:
-            raise RuntimeError(
-                "OpenAI API key not configured. "
-                "Set OPENAI_API_KEY in your .env file to enable image recognition."
-            )
-        
-        prompt = """Analyze this chess board image and provide the FEN notation for the position shown.
-
-Please respond with ONLY the complete FEN string with all fields:
-<piece_placement> <active_color> <castling> <en_passant> <halfmove> <fullmove>
-
-Example: rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1
-
-If you cannot recognize the position, respond with "CANNOT_RECOGNIZE"."""
-
-        try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{media_type};base64,{base64_image}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=200,
-                temperature=0
-            )
-            
-            result = response.choices[0].message.content.strip()
-            
-            if result == "CANNOT_RECOGNIZE":
-                return None
-            
-            fen = self._clean_fen(result)
-            if self._validate_fen(fen):
-                return fen
-            
-            return None
-            
-        except Exception as e:
-            print(f"OpenAI recognition error: {e}")
-            return None
-
+        self._require_openai()
+        return self._call_vision(base64_image, media_type, full_fen=True)
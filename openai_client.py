@@ -0,0 +1,43 @@
+"""
+Shared OpenAI Client
+One client for explanations, image recognition and FEN corrections, so they
+all reuse the same pool of keep-alive connections.
+"""
+
+import os
+import threading
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+    
+    Its httpx pool keeps up to 20 connections alive for a minute, so calls
+    from any module skip the TLS handshake while traffic is steady.
+    
+    Returns:
+        The OpenAI client, or None if OPENAI_API_KEY is not set
+    """
+    global _client
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        return None
+    with _client_lock:
+        if _client is None:
+            # Imported here so deployments without a key never load the SDK
+            import httpx
+            from openai import OpenAI
+            _client = OpenAI(
+                api_key=api_key,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_keepalive_connections=20,
+                        max_connections=20,
+                        keepalive_expiry=60.0
+                    )
+                )
+            )
+        return _client